@@ -1,29 +1,62 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from sklearn.cluster import KMeans
 from umap import UMAP
 from scipy.sparse.csgraph import minimum_spanning_tree
 from sklearn.metrics.pairwise import cosine_distances
-from sklearn.preprocessing import MinMaxScaler
-import openai
-from dotenv import load_dotenv
 import os
 from scipy.spatial import ConvexHull, distance
 from sklearn.metrics.pairwise import euclidean_distances
-
-# Load OpenAI API key from environment variable for security
-load_dotenv()
-api_key = os.getenv("apikey")
-openai.api_key = api_key
-
-def get_embeddings_batch(inputs):
+import time
+from instrumentation import PipelineProfiler, NullProfiler
+from tile_export import export_tiles
+from similarity_index import SimilarityIndex
+from layout import min_spacing, relax_layout
+from map_export import (build_house_table, clean_view_counts, normalize_transcript_lengths,
+                        normalize_view_counts, number_clusters, write_house_table)
+
+_openai = None
+
+def get_openai():
+    # Imported and configured on first use so that builds that never request embeddings skip it
+    global _openai
+    if _openai is None:
+        import openai
+        from dotenv import load_dotenv
+
+        # Load OpenAI API key from environment variable for security
+        load_dotenv()
+        openai.api_key = os.getenv("apikey")
+        _openai = openai
+    return _openai
+
+def get_embeddings_batch(inputs, profiler=None, cache=None):
+    if cache is not None:
+        # Only request embeddings for texts the shared cache has not seen before
+        embeddings = cache.get_many(inputs)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            fetched = get_embeddings_batch([inputs[i] for i in missing], profiler=profiler)
+            fetched = cache.put_many([inputs[i] for i in missing], fetched)
+            for i, embedding in zip(missing, fetched):
+                embeddings[i] = embedding
+        return np.array(embeddings)
+
+    openai = get_openai()
     embeddings = []
     for input_text in inputs:
-        response = openai.Embedding.create(
-            input=input_text,
-            model="text-embedding-3-large"
-        )
+        request_start = time.perf_counter()
+        try:
+            response = openai.Embedding.create(
+                input=input_text,
+                model="text-embedding-3-large"
+            )
+        except Exception:
+            if profiler is not None:
+                profiler.record_embedding_request(time.perf_counter() - request_start, failed=True)
+            raise
+        if profiler is not None:
+            profiler.record_embedding_request(time.perf_counter() - request_start)
         embedding = np.array(response['data'][0]['embedding'])
         embeddings.append(embedding)
     return np.array(embeddings)
@@ -35,7 +68,8 @@ def cosine_similarity(a, b):
     return dot_product / (norm_a * norm_b)
 
 class ClusterCreator:
-    def __init__(self, max_cluster_depth, min_nodes_per_cluster, min_clusters=2, max_clusters=5):
+    def __init__(self, max_cluster_depth, min_nodes_per_cluster, min_clusters=2, max_clusters=5, profiler=None, embedding_cache=None,
+                 min_house_spacing=15, layout_seed=42):
         self.max_cluster_depth = max_cluster_depth
         self.min_nodes_per_cluster = min_nodes_per_cluster
         self.min_clusters = min_clusters
@@ -48,29 +82,37 @@ class ClusterCreator:
         self.umap_coords = None
         self.cluster_names = {}
         self.mst_data = None
+        self.profiler = profiler or NullProfiler()
+        self.embedding_cache = embedding_cache
+        self.min_house_spacing = min_house_spacing  # Before the final x10 scaling
+        self.layout_seed = layout_seed
 
     def make_clusters(self):
-        self.normalize_view_count()
-        self.normalize_transcript_length()
-        
-        embeddings = np.stack(self.workbench['embedding'])
-        n_clusters = min(max(self.min_clusters, len(self.workbench) // self.min_nodes_per_cluster), self.max_clusters)
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        self.workbench['cluster'] = kmeans.fit_predict(embeddings)
-        self.cluster_nodes = self.workbench.groupby('cluster')['Label'].apply(list).to_dict()
-
-        umap_coords_list = []
-        for cluster_id in self.workbench['cluster'].unique():
-            cluster_data = self.workbench[self.workbench['cluster'] == cluster_id]
-            umap_model = UMAP(n_neighbors=min(50, len(cluster_data)-1), min_dist=0.1, n_components=2, metric='cosine')
-            umap_coords = pd.DataFrame(umap_model.fit_transform(np.stack(cluster_data['embedding'])), columns=['x', 'y'])
-            umap_coords['cluster'] = cluster_id
-            umap_coords['Label'] = cluster_data['Label'].values
-            umap_coords['ViewCount'] = cluster_data['ViewCount'].values
-            umap_coords['TranscriptLength'] = cluster_data['TranscriptLength'].values  # Add transcript length
-            umap_coords_list.append(umap_coords)
-        
-        self.umap_coords = pd.concat(umap_coords_list, ignore_index=True)
+        with self.profiler.stage('normalize', rows=len(self.workbench)):
+            self.normalize_view_count()
+            self.normalize_transcript_length()
+
+        with self.profiler.stage('kmeans', rows=len(self.workbench)) as stage:
+            embeddings = np.stack(self.workbench['embedding'])
+            n_clusters = min(max(self.min_clusters, len(self.workbench) // self.min_nodes_per_cluster), self.max_clusters)
+            kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+            self.workbench['cluster'] = kmeans.fit_predict(embeddings)
+            self.cluster_nodes = self.workbench.groupby('cluster')['Label'].apply(list).to_dict()
+            stage['clusters'] = n_clusters
+
+        with self.profiler.stage('umap', rows=len(self.workbench)):
+            umap_coords_list = []
+            for cluster_id in self.workbench['cluster'].unique():
+                cluster_data = self.workbench[self.workbench['cluster'] == cluster_id]
+                umap_model = UMAP(n_neighbors=min(50, len(cluster_data)-1), min_dist=0.1, n_components=2, metric='cosine')
+                umap_coords = pd.DataFrame(umap_model.fit_transform(np.stack(cluster_data['embedding'])), columns=['x', 'y'])
+                umap_coords['cluster'] = cluster_id
+                umap_coords['Label'] = cluster_data['Label'].values
+                umap_coords['ViewCount'] = cluster_data['ViewCount'].values
+                umap_coords['TranscriptLength'] = cluster_data['TranscriptLength'].values  # Add transcript length
+                umap_coords_list.append(umap_coords)
+
+            self.umap_coords = pd.concat(umap_coords_list, ignore_index=True)
 
         self.workbench = pd.merge(self.workbench, self.umap_coords, on=['Label', 'cluster'], how='left')
         self.workbench['z'] = self.workbench['NormalizedViewCount']  # Add normalized view counts as z-coordinate
@@ -79,10 +121,13 @@ class ClusterCreator:
         self.workbench['umap_coords'] = list(zip(self.workbench['x'], self.workbench['y']))
 
         self.assign_cluster_names()
-        self.arrange_clusters_around_center()
-        self.prevent_cluster_overlap()
-        self.space_out_points_within_clusters()  # Separate method for spacing out points within clusters
-        self.create_minimum_spanning_trees()  # Corrected method name
+        with self.profiler.stage('layout', rows=len(self.workbench)) as stage:
+            # Houses are spaced first, so the clusters are placed using the radii they end up with
+            self.space_out_points_within_clusters()  # Separate method for spacing out points within clusters
+            self.arrange_clusters_around_center()
+            self.prevent_cluster_overlap()
+            # Closest pair of houses in world units, after the x10 scaling below
+            stage['min_house_spacing'] = min_spacing(self.workbench[['x', 'y']].to_numpy(dtype=np.float64)) * 10
         self.label_clusters()
 
         # Scale the coordinates after all adjustments
@@ -95,7 +140,9 @@ class ClusterCreator:
             self.cluster_names[cluster_id] = f"Cluster {cluster_id}"  # Simplified naming
 
     def load_skills_data_from_csv(self, csv_file):
-        df = pd.read_csv(csv_file, encoding='utf-8')
+        with self.profiler.stage('read_csv') as stage:
+            df = pd.read_csv(csv_file, encoding='utf-8')
+            stage['rows'] = len(df)
         column_array = []
         final_array = []
         counter2 = 0
@@ -121,10 +168,11 @@ class ClusterCreator:
         transcript_lengths = df['Transcript'].apply(lambda x: len(str(x).split())).tolist()
         df['TranscriptLength'] = transcript_lengths
 
-        embeddings = get_embeddings_batch(final_array)
+        with self.profiler.stage('embeddings', rows=len(final_array)):
+            embeddings = get_embeddings_batch(final_array, profiler=self.profiler, cache=self.embedding_cache)
         label_list = df['Title'].tolist()
         self.workbench = pd.DataFrame({'Label': label_list, 'embedding': list(embeddings)})
-        self.workbench['ViewCount'] = df['ViewCount'].str.replace(',', '').astype(float)  # Clean and convert ViewCount to float
+        self.workbench['ViewCount'] = clean_view_counts(df['ViewCount'])  # Clean and convert ViewCount to float
         self.workbench['TranscriptLength'] = df['TranscriptLength']  # Add transcript length to workbench
 
     def create_connections(self):
@@ -155,31 +203,47 @@ class ClusterCreator:
     def create_minimum_spanning_trees(self):
         minimum_spanning_trees = []
 
-        for cluster_id in self.workbench['cluster'].unique():
-            cluster_data = self.workbench[self.workbench['cluster'] == cluster_id]
-            cluster_coords = cluster_data[['x', 'y']].values
+        with self.profiler.stage('mst', rows=len(self.workbench)) as stage:
+            for cluster_id in self.workbench['cluster'].unique():
+                cluster_data = self.workbench[self.workbench['cluster'] == cluster_id]
+                cluster_coords = cluster_data[['x', 'y']].values
 
-            if len(cluster_coords) > 1:
-                pairwise_distances = euclidean_distances(cluster_coords)
-                mst = minimum_spanning_tree(pairwise_distances)
-                edges = mst.nonzero()
+                if len(cluster_coords) > 1:
+                    pairwise_distances = euclidean_distances(cluster_coords)
+                    mst = minimum_spanning_tree(pairwise_distances)
+                    edges = mst.nonzero()
 
-                for start, end in zip(edges[0], edges[1]):
-                    start_node = cluster_data.iloc[start]['Label']
-                    end_node = cluster_data.iloc[end]['Label']
-                    minimum_spanning_trees.append([cluster_id, start_node, end_node])
+                    for start, end in zip(edges[0], edges[1]):
+                        start_node = cluster_data.iloc[start]['Label']
+                        end_node = cluster_data.iloc[end]['Label']
+                        minimum_spanning_trees.append([cluster_id, start_node, end_node])
+            stage['edges'] = len(minimum_spanning_trees)
 
         return pd.DataFrame(minimum_spanning_trees, columns=['ClusterID', 'StartNode', 'EndNode'])
 
     def save_mst_to_csv(self, output_file):
         mst_df = self.create_minimum_spanning_trees()
-        mst_df.to_csv(output_file, index=False)
+        with self.profiler.stage('save_mst', edges=len(mst_df)):
+            mst_df.to_csv(output_file, index=False)
         print(f"Minimum Spanning Trees saved to {output_file}")
+        return mst_df
+
+    def cluster_radii(self):
+        # Distance from each cluster's centroid to its farthest house, in cluster id order
+        points = self.workbench[['x', 'y']].to_numpy(dtype=np.float64)
+        centroids = self.workbench.groupby('cluster')[['x', 'y']].transform('mean').to_numpy(dtype=np.float64)
+        distances = pd.Series(np.linalg.norm(points - centroids, axis=1), index=self.workbench.index)
+        return distances.groupby(self.workbench['cluster']).max().to_numpy()
 
     def arrange_clusters_around_center(self):
         centroids = self.workbench.groupby('cluster')[['x', 'y']].mean().values.astype(np.float64)
         num_clusters = len(centroids)
         radius = 400  # Adjust the radius to control the spread of clusters around the center point
+        if num_clusters > 1:
+            # Widen the ring until neighbouring clusters are at least one house spacing apart
+            radii = self.cluster_radii()
+            gaps = radii + np.roll(radii, -1) + self.min_house_spacing
+            radius = max(radius, gaps.max() / (2 * np.sin(np.pi / num_clusters)))
 
         # Arrange clusters in a circular pattern around the center point (0, 0)
         for i, centroid in enumerate(centroids):
@@ -196,7 +260,9 @@ class ClusterCreator:
         centroids = self.workbench.groupby('cluster')[['x', 'y']].mean().values.astype(np.float64)
         max_iterations = 100
         learning_rate = 0.1
-        min_distance_between_clusters = 50  # Adjust as needed to prevent overlap
+        # Clusters must be far enough apart that their outermost houses keep the house spacing
+        radii = self.cluster_radii()
+        min_distance_between_clusters = radii[:, None] + radii[None, :] + self.min_house_spacing
 
         for _ in range(max_iterations):
             moved = False
@@ -204,8 +270,8 @@ class ClusterCreator:
                 for j in range(i + 1, len(centroids)):
                     delta = centroids[j] - centroids[i]
                     distance = np.linalg.norm(delta)
-                    if distance < min_distance_between_clusters:
-                        adjustment = (min_distance_between_clusters - distance) * delta / distance * learning_rate
+                    if distance < min_distance_between_clusters[i, j]:
+                        adjustment = (min_distance_between_clusters[i, j] - distance) * delta / distance * learning_rate
                         centroids[i] -= adjustment
                         centroids[j] += adjustment
                         moved = True
@@ -221,12 +287,11 @@ class ClusterCreator:
 
     def space_out_points_within_clusters(self):
         clusters = self.workbench['cluster'].unique()
-        spread_scale_within_clusters = 50  # Reduced scale for spreading out points within clusters
 
-        for cluster_id in clusters:
+        for i, cluster_id in enumerate(clusters):
+            # Relax houses apart to the minimum spacing while keeping them near their UMAP positions
             cluster_points = self.workbench[self.workbench['cluster'] == cluster_id][['x', 'y']].values.astype(np.float64)
-            cluster_center = cluster_points.mean(axis=0)
-            adjusted_points = cluster_points + np.random.normal(scale=spread_scale_within_clusters, size=cluster_points.shape)
+            adjusted_points = relax_layout(cluster_points, self.min_house_spacing, seed=self.layout_seed + i)
             self.workbench.loc[self.workbench['cluster'] == cluster_id, ['x', 'y']] = adjusted_points.astype(np.float32)
 
     def merge_overlapping_clusters(self):
@@ -252,34 +317,24 @@ class ClusterCreator:
         self.workbench.loc[self.workbench['cluster'] == cluster_id2, 'cluster'] = cluster_id1
 
     def normalize_view_count(self):
-        q1 = self.workbench['ViewCount'].quantile(0.25)
-        q3 = self.workbench['ViewCount'].quantile(0.75)
-        iqr = q3 - q1
-        lower_bound = q1 - 1.5 * iqr
-        upper_bound = q3 + 1.5 * iqr
-        
-        # Cap the outliers
-        self.workbench['ViewCount'] = np.where(self.workbench['ViewCount'] < lower_bound, lower_bound, self.workbench['ViewCount'])
-        self.workbench['ViewCount'] = np.where(self.workbench['ViewCount'] > upper_bound, upper_bound, self.workbench['ViewCount'])
-
-        scaler = MinMaxScaler(feature_range=(5, 60))
-        self.workbench['NormalizedViewCount'] = scaler.fit_transform(self.workbench[['ViewCount']])
+        # Outliers are capped at 1.5 IQR before scaling
+        self.workbench['NormalizedViewCount'] = normalize_view_counts(self.workbench['ViewCount'], 5, 60)
 
     def normalize_transcript_length(self):
-        scaler = MinMaxScaler(feature_range=(1, 10))  # Adjust range as needed
-        self.workbench['NormalizedTranscriptLength'] = scaler.fit_transform(self.workbench[['TranscriptLength']])
-        self.workbench['NormalizedTranscriptLength'] = self.workbench['NormalizedTranscriptLength'].round()  # Round to nearest whole number
+        self.workbench['NormalizedTranscriptLength'] = normalize_transcript_lengths(self.workbench['TranscriptLength'], 1, 10)  # Rounded to whole houses
 
     def label_clusters(self):
-        unique_clusters = self.workbench['cluster'].unique()
-        cluster_label_mapping = {cluster: idx + 1 for idx, cluster in enumerate(unique_clusters)}
-        self.workbench['ClusterLabel'] = self.workbench['cluster'].map(cluster_label_mapping)
+        self.workbench['ClusterLabel'] = number_clusters(self.workbench['cluster'])
 
-    def save_to_files(self):
-        self.workbench[['x', 'y', 'z', 'cluster', 'Label', 'NormalizedTranscriptLength']].to_csv('umap_coordinates.csv', index=False)
-        self.workbench[['ClusterLabel']].to_csv('cluster_labels.csv', index=False)
+    def save_to_files(self, output_dir='.'):
+        with self.profiler.stage('save_coordinates', rows=len(self.workbench)):
+            # ClusterLabel is written as an extra column instead of a separate cluster_labels.csv
+            write_house_table(build_house_table(self.workbench), os.path.join(output_dir, 'umap_coordinates'))
 
     def plot_clusters_and_connections_with_mst(self):
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import LineCollection
+
         fig, ax = plt.subplots(figsize=(15, 10))
 
         unique_clusters = self.workbench['cluster'].unique()
@@ -298,17 +353,14 @@ class ClusterCreator:
             ax.scatter(cluster_coords[:, 0], cluster_coords[:, 1], 
                     c=[color], s=50, alpha=0.6, label=f'Cluster {cluster_id}')
 
-            # Plot MST edges
-            for start, end in zip(edges[0], edges[1]):
-                ax.plot([cluster_coords[start, 0], cluster_coords[end, 0]],
-                        [cluster_coords[start, 1], cluster_coords[end, 1]],
-                        c=color, alpha=0.5, linewidth=1.5)
+            # Plot MST edges as one collection rather than one line per edge
+            ax.add_collection(LineCollection(np.stack([cluster_coords[edges[0]], cluster_coords[edges[1]]], axis=1),
+                                             colors=[color], alpha=0.5, linewidths=1.5))
 
             # Draw convex hull
             if len(cluster_coords) >= 3:
                 hull = ConvexHull(cluster_coords)
-                for simplex in hull.simplices:
-                    ax.plot(cluster_coords[simplex, 0], cluster_coords[simplex, 1], linestyle='--', color=color, alpha=0.8)
+                ax.add_collection(LineCollection(cluster_coords[hull.simplices], colors=[color], linestyles='--', alpha=0.8))
 
         # Plot the central point
         ax.scatter(0, 0, c='black', s=100, marker='x', label='Center Point')
@@ -320,16 +372,58 @@ class ClusterCreator:
         plt.tight_layout()
         plt.show()
 
+def build_map(csv_file, output_dir='.', max_cluster_depth=2, min_nodes=10, profiler=None, plot=False, embedding_cache=None, tile_size=None, previews=False,
+              minimap_levels=None, profile_stage=None, minimap_resolution=512):
+    # profile_stage only applies when no profiler is passed in; its cProfile dump goes next to the other outputs
+    profiler = profiler or PipelineProfiler(profile_stage, os.path.join(output_dir, f"{profile_stage}.prof"))
+    os.makedirs(output_dir, exist_ok=True)
+
+    cluster_creator = ClusterCreator(max_cluster_depth, min_nodes, profiler=profiler, embedding_cache=embedding_cache)
+    cluster_creator.load_skills_data_from_csv(csv_file)
+    if cluster_creator.workbench is None:
+        raise ValueError(f"No videos could be loaded from {csv_file}")
+    cluster_creator.make_clusters()
+    with profiler.stage('connections'):
+        cluster_creator.create_connections()
+    if plot:
+        cluster_creator.plot_clusters_and_connections_with_mst()
+    mst_df = cluster_creator.save_mst_to_csv(os.path.join(output_dir, "mst_data.csv"))
+    cluster_creator.save_to_files(output_dir)
+    with profiler.stage('similarity_index', rows=len(cluster_creator.workbench)):
+        index = SimilarityIndex.build(cluster_creator.workbench['embedding'], cluster_creator.workbench['Label'],
+                                      cluster_creator.workbench[['x', 'y', 'z']].to_numpy())
+        index.save(os.path.join(output_dir, 'similar_videos.npz'))
+    if tile_size:
+        with profiler.stage('tiles', rows=len(cluster_creator.workbench), edges=len(mst_df)):
+            houses = cluster_creator.workbench[['x', 'y', 'z', 'cluster', 'Label', 'NormalizedTranscriptLength']]
+            export_tiles(houses, mst_df, os.path.join(output_dir, 'tiles'), tile_size, cluster_creator.cluster_names)
+    if previews:
+        from render import render_minimap, render_preview
+
+        with profiler.stage('previews', rows=len(cluster_creator.workbench), edges=len(mst_df)):
+            houses = cluster_creator.workbench[['x', 'y', 'cluster', 'Label']]
+            render_preview(houses, mst_df, os.path.join(output_dir, 'preview.png'), cluster_creator.cluster_names)
+            render_preview(houses, mst_df, os.path.join(output_dir, 'preview.svg'), cluster_creator.cluster_names)
+            render_minimap(houses, mst_df, os.path.join(output_dir, 'minimap.png'), minimap_resolution)
+    if minimap_levels:
+        from minimap_pyramid import bake_pyramid
+
+        with profiler.stage('minimap_pyramid', rows=len(cluster_creator.workbench), edges=len(mst_df)):
+            houses = cluster_creator.workbench[['x', 'y', 'cluster', 'Label']]
+            bake_pyramid(houses, mst_df, os.path.join(output_dir, 'minimap'), cluster_creator.cluster_names, minimap_levels)
+    if profiler.profile_stage and not any('profile' in record for record in profiler.stages):
+        print(f"Warning: no stage named {profiler.profile_stage!r} ran, so nothing was profiled")
+    profiler.write_report(os.path.join(output_dir, "run_report.json"))
+    return cluster_creator
+
 # Example usage
 if __name__ == "__main__":
     csv_file = "chemistry2"
     max_cluster_depth = 2
     min_nodes = 10
+    profile_stage = os.getenv("PROFILE_STAGE")  # e.g. PROFILE_STAGE=umap dumps umap.prof for that stage
+    trace_memory = os.getenv("TRACE_MEMORY") == "1"  # Slow; adds tracemalloc peaks to the report
 
-    cluster_creator = ClusterCreator(max_cluster_depth, min_nodes)
-    cluster_creator.load_skills_data_from_csv(csv_file)
-    cluster_creator.make_clusters()
-    cluster_creator.create_connections()
-    cluster_creator.plot_clusters_and_connections_with_mst()
-    cluster_creator.save_mst_to_csv("mst_data.csv")
-    cluster_creator.save_to_files()
+    profiler = PipelineProfiler(profile_stage=profile_stage, trace_memory=trace_memory)
+    build_map(csv_file, ".", max_cluster_depth, min_nodes, profiler=profiler, plot=True)
+    profiler.print_summary()
@@ -1,15 +1,17 @@
 import pandas as pd
 import numpy as np
 import os
-import openai
-from dotenv import load_dotenv
 from umap import UMAP
 import fastcluster
 from scipy.cluster import hierarchy as sch
 from scipy.sparse.csgraph import minimum_spanning_tree
 import uuid
+from layout import relax_layout
+from map_export import build_house_table, write_house_table
 
 def get_embeddings_batch(inputs):
+    import openai
+
     embeddings = []
     for input_text in inputs:
         try:
@@ -68,6 +70,7 @@ class ClusterCreator:
             return
 
         self.workbench = pd.DataFrame({'Label': label_list, 'embedding': list(embeddings), 'ViewCount': view_count_list})
+        self.workbench['TranscriptLength'] = pd.Series(final_array).str.split().str.len()
 
     def make_clusters(self):
         if self.workbench is None or self.workbench.empty:
@@ -121,24 +124,36 @@ class ClusterCreator:
         self.clusters = pd.DataFrame(cluster_list)
         self.clusters.set_index('id', inplace=True)
         self.workbench['cluster'] = self.workbench['Label'].map(self.skill_cluster_mapping)
+        self.number_clusters()
 
         umap_model = UMAP(n_neighbors=50, min_dist=0.5, n_components=2, metric='cosine')
         embedding_array = np.stack(self.workbench['embedding'])
         umap_coords = umap_model.fit_transform(embedding_array) * 750
-        self.umap_coords = pd.Series(umap_coords.tolist())
-        self.workbench['umap_coords'] = self.umap_coords
 
         # Spread out the UMAP coordinates
-        self.spread_out_umap_coords()
+        umap_coords = self.spread_out_umap_coords(umap_coords)
+        self.umap_coords = pd.Series(umap_coords.tolist())
+        self.workbench['umap_coords'] = self.umap_coords
 
-    def spread_out_umap_coords(self):
+    def number_clusters(self):
+        """
+        Replace the cluster UUIDs with integers in order of first appearance, once, so the house table and the
+        MST CSV share the same ids. Videos that joined no cluster (the tree split above max_cluster_depth
+        around them) are grouped into one extra cluster numbered after the others.
         """
-        Adjust the UMAP coordinates to increase spacing between houses.
+        unclustered = self.workbench['cluster'].isna().to_numpy()
+        codes, cluster_ids = pd.factorize(self.workbench['cluster'], sort=False)
+        self.cluster_numbers = {cluster_id: number for number, cluster_id in enumerate(cluster_ids)}
+        if unclustered.any():
+            codes[unclustered] = len(cluster_ids)
+            print(f"{unclustered.sum()} videos are in no cluster; they are grouped as cluster {len(cluster_ids)}")
+        self.workbench['cluster'] = codes
+
+    def spread_out_umap_coords(self, umap_coords, min_spacing=200, seed=42):
         """
-        spread_factor = 200  # You can adjust this factor as needed for more spacing
-        for i, coords in enumerate(self.umap_coords):
-            # Add a fixed offset to spread out the points
-            self.umap_coords[i] = (coords[0] + (i % 10) * spread_factor, coords[1] + (i // 10) * spread_factor)
+        Adjust the UMAP coordinates so no two houses are closer than min_spacing, keeping each near its UMAP position.
+        """
+        return relax_layout(umap_coords, min_spacing, seed=seed)
 
     def merge_cluster(self, parent_id, child_id):
         child_nodes = self.cluster_nodes.pop(child_id, [])
@@ -182,32 +197,15 @@ class ClusterCreator:
         print(f"Minimum Spanning Trees saved to {output_file}")
 
     def save_umap_coords_to_csv(self, output_file):
-        umap_coords_df = self.workbench[['Label', 'umap_coords']].copy()
-        umap_coords_df[['x', 'y']] = pd.DataFrame(umap_coords_df['umap_coords'].tolist(), index=umap_coords_df.index)
-        umap_coords_df.drop('umap_coords', axis=1, inplace=True)
-
-        # Clean and convert view counts to numeric values
-        self.workbench['ViewCount'] = self.workbench['ViewCount'].str.replace(',', '').str.replace('"', '')
-        view_counts = pd.to_numeric(self.workbench['ViewCount'], errors='coerce')
-        
-        min_view_count = view_counts.min()
-        max_view_count = view_counts.max()
-        
-        if min_view_count is None or max_view_count is None or min_view_count == max_view_count:
-            print("Error: Invalid view count data for normalization.")
-            return
-
-        def normalize_view_count(view_count, min_view, max_view):
-            return 5 + (view_count - min_view) * (30 / (max_view - min_view))
-        
-        umap_coords_df['z'] = [normalize_view_count(vc, min_view_count, max_view_count) for vc in view_counts]
-
-        print(umap_coords_df.head())  # Debugging line to print the first few rows of the DataFrame
-        umap_coords_df.to_csv(output_file, index=False)
-        print(f"UMAP coordinates saved to {output_file}")
+        # View counts are scaled linearly to 5-35 without capping outliers
+        houses = build_house_table(self.workbench, z_range=(5, 35), cap_outliers=False)
+        write_house_table(houses, os.path.splitext(output_file)[0])
 
 # Example usage
 if __name__ == "__main__":
+    import openai
+    from dotenv import load_dotenv
+
     load_dotenv()
     api_key = os.getenv("apikey")
     if not api_key:
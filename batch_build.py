@@ -0,0 +1,198 @@
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+
+# Optional manifest columns and the value used when a course leaves them out
+MANIFEST_DEFAULTS = {'max_cluster_depth': 2, 'min_nodes': 10}
+
+
+def init_worker(memory_limit_mb, threads_per_worker):
+    # Split the cores between workers instead of letting every UMAP/BLAS call grab all of them.
+    # This runs before the worker imports numba or numpy, so the settings take effect.
+    for variable in ('NUMBA_NUM_THREADS', 'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ.setdefault(variable, str(threads_per_worker))
+
+    # Caps the address space of each worker so one oversized course fails on its own
+    # with a MemoryError instead of pushing the whole machine into swap
+    if memory_limit_mb:
+        # Unix only, so imported here; run_batch refuses a memory limit where it is missing
+        import resource
+
+        limit = int(memory_limit_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def load_manifest(manifest_file):
+    """
+    Read a manifest of courses to build. Either a CSV with 'course' and 'csv_file' columns or a
+    JSON list of objects with the same keys. 'max_cluster_depth' and 'min_nodes' are optional.
+    """
+    # Not imported at module level: spawned workers re-import this module, and numpy must not
+    # be loaded before init_worker sets the thread counts
+    import pandas as pd
+
+    if manifest_file.endswith('.json'):
+        with open(manifest_file, encoding='utf-8') as f:
+            manifest = pd.DataFrame(json.load(f))
+    else:
+        manifest = pd.read_csv(manifest_file, encoding='utf-8')
+
+    missing_columns = {'course', 'csv_file'} - set(manifest.columns)
+    if missing_columns:
+        raise ValueError(f"Manifest {manifest_file} is missing columns: {sorted(missing_columns)}")
+    if manifest['course'].duplicated().any():
+        raise ValueError(f"Manifest {manifest_file} lists a course more than once")
+
+    # Blank optional cells are read as NaN; fall back to the build_map defaults for them
+    for column, default in MANIFEST_DEFAULTS.items():
+        manifest[column] = manifest[column].fillna(default).astype(int) if column in manifest else default
+
+    # Relative CSV paths are resolved against the manifest's directory
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    manifest['csv_file'] = [path if os.path.isabs(path) else os.path.join(base_dir, path) for path in manifest['csv_file']]
+    return manifest.to_dict('records')
+
+
+def build_course(job, output_root, embedding_cache_path, tile_size=None, previews=False, minimap_levels=None,
+                 profile_stage=None, minimap_resolution=512):
+    # Imported in the worker so the parent process stays light
+    from Cluster import build_map
+    from embedding_cache import EmbeddingCache
+
+    output_dir = os.path.join(output_root, str(job['course']))
+    start = time.perf_counter()
+    cache = EmbeddingCache(embedding_cache_path) if embedding_cache_path else None
+    try:
+        build_map(job['csv_file'], output_dir,
+                  job['max_cluster_depth'], job['min_nodes'],
+                  embedding_cache=cache, tile_size=tile_size, previews=previews, minimap_levels=minimap_levels,
+                  profile_stage=profile_stage, minimap_resolution=minimap_resolution)
+    finally:
+        if cache is not None:
+            cache.close()
+    return {'course': job['course'], 'status': 'done', 'output_dir': output_dir,
+            'seconds': time.perf_counter() - start}
+
+
+def run_pool(jobs, workers, pool_options, build_args):
+    """
+    Build jobs in one worker pool, with at most one course per worker submitted at a time. Returns the results
+    of every course that finished or raised, the courses lost because a worker died and broke the pool, and
+    the courses never submitted because of it.
+    """
+    pending = list(jobs)
+    results, lost = [], []
+    with ProcessPoolExecutor(max_workers=workers, **pool_options) as executor:
+        in_flight = {}
+        while (pending or in_flight) and not lost:
+            while pending and len(in_flight) < workers:
+                job = pending.pop(0)
+                in_flight[executor.submit(build_course, job, *build_args)] = job
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = in_flight.pop(future)
+                try:
+                    result = future.result()
+                    print(f"Built {result['course']} in {result['seconds']:.1f}s")
+                except BrokenProcessPool:
+                    lost.append(job)
+                    continue
+                except Exception as e:
+                    result = {'course': job['course'], 'status': 'failed', 'error': f"{type(e).__name__}: {e}",
+                              'traceback': traceback.format_exception(e)}
+                    print(f"Failed to build {job['course']}: {result['error']}")
+                results.append(result)
+        # Once the pool is broken, every course still in flight fails with it
+        for future, job in in_flight.items():
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                lost.append(job)
+            except Exception as e:
+                results.append({'course': job['course'], 'status': 'failed', 'error': f"{type(e).__name__}: {e}",
+                                'traceback': traceback.format_exception(e)})
+    return results, lost, pending
+
+
+def run_batch(manifest_file, output_root, workers=None, memory_limit_mb=None, embedding_cache_path=None, tile_size=None,
+              previews=False, minimap_levels=None, recycle_workers=None, profile_stage=None, minimap_resolution=512):
+    if memory_limit_mb and importlib.util.find_spec('resource') is None:
+        raise ValueError("A per-worker memory limit needs the Unix resource module, which this platform lacks")
+    jobs = load_manifest(manifest_file)
+    os.makedirs(output_root, exist_ok=True)
+    if embedding_cache_path is None:
+        embedding_cache_path = os.path.join(output_root, 'embedding_cache.sqlite')
+
+    workers = workers or os.cpu_count() or 1
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+
+    # Workers are reused by default, so imports and numba's compiled kernels carry over between courses.
+    # The memory limit holds for the whole life of a worker. recycle_workers replaces each worker after
+    # that many courses, to hand back memory that fragmentation or a leak has kept hold of.
+    # Spawned rather than forked, so workers load numpy after init_worker has set the thread counts
+    pool_options = {'mp_context': multiprocessing.get_context('spawn'), 'initializer': init_worker,
+                    'initargs': (memory_limit_mb, threads_per_worker), 'max_tasks_per_child': recycle_workers}
+    build_args = (output_root, embedding_cache_path, tile_size, previews, minimap_levels, profile_stage,
+                  minimap_resolution)
+
+    # A worker killed outright (by the OOM killer, or a native abort under the memory limit) breaks the whole
+    # pool, and the courses in flight with it. Those are retried in a fresh pool with the rest of the batch.
+    # A course lost twice is built in a pool of its own, so only the course that kills its worker is failed.
+    results, pending, lost_before = [], jobs, set()
+    while pending:
+        finished, lost, pending = run_pool(pending, workers, pool_options, build_args)
+        results.extend(finished)
+        if lost:
+            print(f"A worker died while building {', '.join(str(job['course']) for job in lost)}; starting a new pool")
+        for job in lost:
+            if job['course'] not in lost_before:
+                lost_before.add(job['course'])
+                pending.insert(0, job)
+                continue
+            isolated, lost_again, _ = run_pool([job], 1, pool_options, build_args)
+            results.extend(isolated)
+            if lost_again:
+                results.append({'course': job['course'], 'status': 'failed',
+                                'error': "BrokenProcessPool: the worker building this course died"})
+                print(f"Failed to build {job['course']}: its worker died")
+
+    failures = [result for result in results if result['status'] == 'failed']
+    summary = {'manifest': manifest_file, 'courses': len(jobs), 'failed': len(failures), 'results': results}
+    summary_file = os.path.join(output_root, 'batch_summary.json')
+    with open(summary_file, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, default=str)
+    print(f"{len(jobs) - len(failures)}/{len(jobs)} courses built, summary saved to {summary_file}")
+    return summary
+
+
+# Example usage:
+#   python batch_build.py courses.csv --output-dir maps --workers 4 --memory-limit-mb 4096
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build one map per course listed in a manifest, in parallel.")
+    parser.add_argument('manifest', help="CSV or JSON manifest with 'course' and 'csv_file' entries")
+    parser.add_argument('--output-dir', default='maps', help="Each course is written to <output-dir>/<course>")
+    parser.add_argument('--workers', type=int, default=None, help="Defaults to the number of CPUs")
+    parser.add_argument('--memory-limit-mb', type=int, default=None, help="Address space limit per worker")
+    parser.add_argument('--embedding-cache', default=None, help="Defaults to <output-dir>/embedding_cache.sqlite")
+    parser.add_argument('--tile-size', type=float, default=None, help="Also export streamable tiles of this size")
+    parser.add_argument('--previews', action='store_true', help="Also render PNG/SVG previews and a minimap raster")
+    parser.add_argument('--minimap-resolution', type=int, default=512,
+                        help="Side in pixels of the minimap raster written with --previews")
+    parser.add_argument('--minimap-levels', type=int, default=None, help="Also bake a minimap tile pyramid this deep")
+    parser.add_argument('--recycle-workers', type=int, default=None, metavar='N',
+                        help="Replace each worker after N courses. By default workers live for the whole batch")
+    parser.add_argument('--profile-stage', default=None,
+                        help="Run this stage under cProfile and save <stage>.prof in each course's output folder")
+    args = parser.parse_args()
+
+    summary = run_batch(args.manifest, args.output_dir, args.workers, args.memory_limit_mb, args.embedding_cache,
+                        args.tile_size, args.previews, args.minimap_levels, args.recycle_workers,
+                        args.profile_stage, args.minimap_resolution)
+    raise SystemExit(1 if summary['failed'] else 0)
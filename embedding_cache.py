@@ -0,0 +1,56 @@
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of embeddings keyed by model and input text. Backed by SQLite so several
+    build processes can share one cache file.
+    """
+
+    def __init__(self, path, model="text-embedding-3-large"):
+        self.path = path
+        self.model = model
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self.connection.commit()
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, texts):
+        keys = [self.key(text) for text in texts]
+        found = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+            )
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32)
+        return [found.get(key) for key in keys]
+
+    def put_many(self, texts, embeddings):
+        """
+        Store the embeddings as float32 and return them as stored, so a build that fetched them sees
+        exactly the vectors that later builds will read back.
+        """
+        vectors = [np.asarray(embedding, dtype=np.float32) for embedding in embeddings]
+        rows = [(self.key(text), vector.tobytes()) for text, vector in zip(texts, vectors)]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+        return vectors
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,154 @@
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module; peak RSS is then not recorded
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def current_rss_mb():
+    # Resident set size right now, from /proc on Linux. None where that is not available
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class PipelineProfiler:
+    """
+    Records wall time, CPU time, memory and row/edge counts for every stage of a map build,
+    plus the count and latency of embedding requests, and writes them out as a JSON run report.
+
+    Per-stage memory comes from the resident set size: the RSS when the stage ends, its change over the
+    stage, and how far the stage pushed the process high-water mark. trace_memory additionally records
+    the Python allocation peak with tracemalloc, which slows numpy- and numba-heavy stages several times
+    over, so it is for memory investigations only.
+    """
+
+    def __init__(self, profile_stage=None, profile_output=None, trace_memory=False):
+        self.stages = []
+        self.embedding_latencies = []
+        self.embedding_failures = 0
+        self.profile_stage = profile_stage  # Name of the stage to run under cProfile
+        self.profile_output = profile_output or f"{profile_stage}.prof"
+        self.trace_memory = trace_memory
+        self.started_at = time.time()
+        self._depth = 0
+
+    @contextmanager
+    def stage(self, name, **counts):
+        record = {'stage': name, 'depth': self._depth}
+        record.update(counts)
+
+        profiler = cProfile.Profile() if name == self.profile_stage else None
+        start_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+        rss_start = current_rss_mb()
+        peak_start = peak_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        self._depth += 1
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profile_output)
+                record['profile'] = self.profile_output
+            self._depth -= 1
+            record['wall_seconds'] = time.perf_counter() - wall_start
+            record['cpu_seconds'] = time.process_time() - cpu_start
+            rss_end = current_rss_mb()
+            record['rss_mb'] = rss_end
+            record['rss_delta_mb'] = rss_end - rss_start if rss_end is not None and rss_start is not None else None
+            # ru_maxrss only ever grows, so its growth is the amount this stage raised the process peak by
+            peak_end = peak_rss_mb()
+            record['peak_rss_growth_mb'] = peak_end - peak_start if peak_end is not None else None
+            if self.trace_memory:
+                # Nested stages reset the peak, so an outer stage only sees the peak since its last child
+                record['tracemalloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            if start_tracing:
+                tracemalloc.stop()
+            self.stages.append(record)
+
+    def record_embedding_request(self, latency, failed=False):
+        self.embedding_latencies.append(latency)
+        if failed:
+            self.embedding_failures += 1
+
+    def embedding_summary(self):
+        summary = {'requests': len(self.embedding_latencies), 'failures': self.embedding_failures}
+        if self.embedding_latencies:
+            latencies = np.asarray(self.embedding_latencies)
+            for percentile in (50, 90, 99):
+                summary[f'p{percentile}_seconds'] = float(np.percentile(latencies, percentile))
+            summary['max_seconds'] = float(latencies.max())
+            summary['total_seconds'] = float(latencies.sum())
+        return summary
+
+    def report(self):
+        return {
+            'started_at': self.started_at,
+            'total_wall_seconds': time.time() - self.started_at,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': self.stages,
+            'embeddings': self.embedding_summary(),
+        }
+
+    def write_report(self, output_file):
+        directory = os.path.dirname(output_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        print(f"Run report saved to {output_file}")
+
+    def print_summary(self):
+        for record in self.stages:
+            indent = "  " * record['depth']
+            memory = f"{record['rss_mb']:.0f} MB RSS" if record['rss_mb'] is not None else "RSS unavailable"
+            if record['peak_rss_growth_mb'] is not None:
+                memory += f", +{record['peak_rss_growth_mb']:.0f} MB peak"
+            print(f"{indent}{record['stage']}: {record['wall_seconds']:.2f}s wall, "
+                  f"{record['cpu_seconds']:.2f}s cpu, {memory}")
+        embeddings = self.embedding_summary()
+        if embeddings['requests']:
+            print(f"Embedding requests: {embeddings['requests']} "
+                  f"(p50 {embeddings['p50_seconds']:.3f}s, p99 {embeddings['p99_seconds']:.3f}s)")
+
+
+class NullProfiler:
+    """Stand-in used when a build runs without instrumentation."""
+
+    @contextmanager
+    def stage(self, name, **counts):
+        yield dict(counts)
+
+    def record_embedding_request(self, latency, failed=False):
+        pass
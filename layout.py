@@ -0,0 +1,145 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Neighbouring cells to check for each cell. Only half of the 3x3 block is listed, so each pair of cells is visited once.
+NEIGHBOUR_OFFSETS = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]
+
+
+def close_pairs(points, radius):
+    """
+    Find every pair of points closer than radius. Points are hashed into a grid of radius-sized cells,
+    and only points in the same or adjacent cells are compared. Cost is O(n log n) for the sort plus
+    the number of nearby pairs, instead of O(n^2). Returns index arrays i, j with i != j.
+    """
+    cells = np.floor(points / radius).astype(np.int64)
+    # Shift so neighbour cells are never negative and keys stay unique
+    cells -= cells.min(axis=0) - 1
+    height = cells[:, 1].max() + 2
+    keys = cells[:, 0] * height + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    first, second = [], []
+    for dx, dy in NEIGHBOUR_OFFSETS:
+        neighbour_keys = (cells[:, 0] + dx) * height + (cells[:, 1] + dy)
+        starts = np.searchsorted(sorted_keys, neighbour_keys, side='left')
+        counts = np.searchsorted(sorted_keys, neighbour_keys, side='right') - starts
+        i = np.repeat(np.arange(len(points)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(starts, counts) + within]
+        if dx == 0 and dy == 0:
+            keep = i < j
+            i, j = i[keep], j[keep]
+        first.append(i)
+        second.append(j)
+    i = np.concatenate(first)
+    j = np.concatenate(second)
+
+    distances = np.linalg.norm(points[i] - points[j], axis=1)
+    close = distances < radius
+    return i[close], j[close]
+
+
+def min_spacing(points):
+    """
+    Distance between the closest pair of points, or inf for fewer than two points.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 2:
+        return np.inf
+    distances, _ = cKDTree(points).query(points, k=2)
+    return float(distances[:, 1].min())
+
+
+def relax_layout(anchors, min_distance, iterations=100, anchor_strength=0.1, seed=42):
+    """
+    Spread points apart until no two are closer than min_distance, while pulling each one back toward
+    its anchor (its UMAP position) so semantic neighbours stay together.
+
+    The anchors are first scaled about their centroid so that the densest tenth of the layout has room
+    for its points. Density is measured from the distance to each point's sixth nearest neighbour, which
+    is what it would be in a hexagonal packing, so a few far outliers do not hide a dense core. After at
+    most `iterations` relaxation steps, any overlap left is removed by one more uniform scale, so the
+    result always keeps min_distance. Deterministic for a given seed.
+    """
+    anchors = np.asarray(anchors, dtype=np.float64)
+    n = len(anchors)
+    if n < 2:
+        return anchors.copy()
+
+    rng = np.random.default_rng(seed)
+    center = anchors.mean(axis=0)
+    k = min(6, n - 1)
+    neighbour_distances, _ = cKDTree(anchors).query(anchors, k=k + 1)
+    local_spacing = np.percentile(neighbour_distances[:, k], 10)
+    # 20% slack lets the relaxation settle dense areas without the anchors pulling them back into overlap
+    required_spacing = 1.2 * min_distance
+    if 0 < local_spacing < required_spacing:
+        anchors = center + (anchors - center) * (required_spacing / local_spacing)
+
+    # A little seeded jitter separates duplicate anchors, which would otherwise have no direction to move apart in
+    positions = anchors + rng.normal(scale=1e-3 * min_distance, size=anchors.shape)
+
+    for step in range(iterations):
+        # The pull toward the anchors fades out, so the last steps only separate points
+        positions += anchor_strength * (1 - step / iterations) * (anchors - positions)
+
+        i, j = close_pairs(positions, min_distance)
+        if len(i) == 0:
+            break
+
+        delta = positions[i] - positions[j]
+        distances = np.linalg.norm(delta, axis=1)
+        coincident = distances < 1e-9
+        if coincident.any():
+            angles = rng.uniform(0, 2 * np.pi, size=coincident.sum())
+            delta[coincident] = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+            distances[coincident] = 1
+        # Each step closes 80% of every overlap, split between both points. Stopping short of the full
+        # overlap damps the overshoot when a point overlaps several neighbours at once
+        push = (delta / distances[:, None]) * ((min_distance - distances) * 0.4)[:, None]
+        for axis in range(2):
+            positions[:, axis] += np.bincount(i, weights=push[:, axis], minlength=n)
+            positions[:, axis] -= np.bincount(j, weights=push[:, axis], minlength=n)
+
+    # Scaling multiplies every distance by the same factor, so this lifts the closest pair to min_distance
+    # without disturbing the relaxed arrangement. The small margin survives callers storing float32 coordinates
+    closest = min_spacing(positions)
+    if closest < min_distance:
+        center = positions.mean(axis=0)
+        positions = center + (positions - center) * (min_distance / max(closest, 1e-9) * (1 + 1e-4))
+    return positions
+
+
+def clustered_points(n, seed=0):
+    # Test layout shaped like UMAP output: a few tight blobs plus 10% scattered outliers
+    rng = np.random.default_rng(seed)
+    n_outliers = n // 10
+    centers = rng.normal(scale=4, size=(5, 2))
+    blobs = centers[rng.integers(0, 5, n - n_outliers)] + rng.normal(scale=0.3, size=(n - n_outliers, 2))
+    return np.concatenate([blobs, rng.uniform(-15, 15, size=(n_outliers, 2))])
+
+
+# Example usage:
+#   python layout.py --sizes 200 2000 10000
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Check that relax_layout keeps the minimum spacing on clustered input.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 2000])
+    parser.add_argument('--min-distance', type=float, default=15)
+    args = parser.parse_args()
+
+    failed = False
+    for n in args.sizes:
+        points = clustered_points(n)
+        start = time.perf_counter()
+        positions = relax_layout(points, args.min_distance)
+        elapsed = time.perf_counter() - start
+        ratio = min_spacing(positions) / args.min_distance
+        neighbour_distances, _ = cKDTree(positions).query(positions, k=2)
+        crowded = np.mean(neighbour_distances[:, 1] < 1.1 * args.min_distance)
+        print(f"{n} points: closest pair {ratio:.3f}x min distance, {crowded:.0%} of points within 1.1x, {elapsed:.2f}s")
+        failed |= ratio < 1
+    raise SystemExit(1 if failed else 0)
@@ -4,19 +4,22 @@ from scipy.cluster import hierarchy as sch
 import numpy as np
 import uuid
 import os
-import openai
-import matplotlib.pyplot as plt
 import umap.umap_ as umap
 from scipy.sparse.csgraph import minimum_spanning_tree
 import scipy
-from sklearn.manifold import TSNE
-import matplotlib.cm as cm
-from adjustText import adjust_text
-from openai import OpenAI
 
-# Load OpenAI API key from environment variable for security
+_client = None
+
+def get_client():
+    # The OpenAI client is created on first use instead of at import time
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(api_key="apikey")
+    return _client
 
 def get_embeddings_batch(inputs):
+    client = get_client()
     embeddings = []
     for input_text in inputs:
         response = client.embeddings.create(
@@ -126,6 +129,7 @@ class ClusterCreator:
             self.cluster_names[cluster_id] = label
 
     def generate_label_with_chatgpt(self, context):
+        client = get_client()
         label = client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
@@ -173,13 +177,14 @@ class ClusterCreator:
 
     def create_connections(self):
         unique_clusters = set(self.workbench['cluster'])
-        connections = {'FirstPair': [], 'SecondPair': []}
+        connections = {'FirstPair': [], 'SecondPair': [], 'FirstIndex': [], 'SecondIndex': []}
 
         for cluster in unique_clusters:
             cluster_points = self.workbench[self.workbench['cluster'] == cluster]['embedding']
 
             max_similarity = -np.inf
             best_pair = (None, None)
+            best_indices = (None, None)
 
             for other_cluster in unique_clusters:
                 if other_cluster == cluster:
@@ -187,16 +192,20 @@ class ClusterCreator:
                     
                 other_cluster_points = self.workbench[self.workbench['cluster'] == other_cluster]['embedding']
 
-                for point1 in cluster_points:
-                    for point2 in other_cluster_points:
+                for index1, point1 in cluster_points.items():
+                    for index2, point2 in other_cluster_points.items():
                         similarity = cosine_similarity(point1, point2)
                         if similarity > max_similarity:
                             max_similarity = similarity
                             best_pair = (point1, point2)
+                            best_indices = (index1, index2)
 
             if best_pair[0] is not None and best_pair[1] is not None:
                 connections['FirstPair'].append(best_pair[0])
                 connections['SecondPair'].append(best_pair[1])
+                # Row indices let the plot find the pair without searching the embeddings
+                connections['FirstIndex'].append(best_indices[0])
+                connections['SecondIndex'].append(best_indices[1])
                     
         self.connections = pd.DataFrame(connections)
 
@@ -216,10 +225,12 @@ class ClusterCreator:
 
         return minimum_spanning_trees
 
-    def plot_clusters_and_connections_with_mst(self):
-        embedding_array = np.stack(self.workbench['embedding'])
-        umap_model = umap.UMAP(n_neighbors=50, min_dist=0.1, n_components=2, metric='cosine')
-        all_embeddings = umap_model.fit_transform(embedding_array)
+    def plot_clusters_and_connections_with_mst(self, show_labels=True):
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import LineCollection
+
+        # Reuse the layout computed in make_clusters instead of fitting UMAP again
+        all_embeddings = np.array(self.umap_coords.tolist())
 
         unique_clusters = self.workbench['cluster'].unique()
         cluster_labels = {cluster: label for label, cluster in enumerate(unique_clusters)}
@@ -227,6 +238,8 @@ class ClusterCreator:
         colors = [cluster_labels[cluster] for cluster in self.workbench['cluster']]
         plt.scatter(all_embeddings[:, 0], all_embeddings[:, 1], c=colors, cmap='viridis', alpha=0.5)
 
+        mst_segments = []
+        hull_segments = []
         for cluster_id in unique_clusters:
             cluster_indices = self.workbench[self.workbench['cluster'] == cluster_id].index
             cluster_coords = all_embeddings[cluster_indices]
@@ -234,61 +247,53 @@ class ClusterCreator:
             pairwise_distances = scipy.spatial.distance.squareform(scipy.spatial.distance.pdist(cluster_coords))
             mst = minimum_spanning_tree(pairwise_distances)
             edges = mst.nonzero()
-            edges = np.vstack((edges[0], edges[1])).T
-
-            for edge in edges:
-                start_point = cluster_coords[edge[0]]
-                end_point = cluster_coords[edge[1]]
-                plt.plot([start_point[0], end_point[0]], [start_point[1], end_point[1]], color='green')
+            mst_segments.append(np.stack([cluster_coords[edges[0]], cluster_coords[edges[1]]], axis=1))
 
             if len(cluster_coords) >= 3:
                 hull = scipy.spatial.ConvexHull(cluster_coords)
-                x_hull = np.append(cluster_coords[hull.vertices, 0], cluster_coords[hull.vertices[0], 0])
-                y_hull = np.append(cluster_coords[hull.vertices, 1], cluster_coords[hull.vertices[0], 1])
-                plt.plot(x_hull, y_hull, color='gray', linestyle='--', linewidth=1)
+                hull_segments.append(cluster_coords[hull.simplices])
 
             # Annotate the cluster with its name at the centroid
             cluster_name = self.cluster_names.get(cluster_id, 'Unknown')
             centroid = np.mean(cluster_coords, axis=0)
             plt.text(centroid[0], centroid[1], cluster_name, fontsize=10, fontweight='bold', ha='center')
 
-        for i in range(len(self.connections['FirstPair'])):
-            first_pair_idx = np.where(np.all(embedding_array == self.connections['FirstPair'][i], axis=1))[0][0]
-            second_pair_idx = np.where(np.all(embedding_array == self.connections['SecondPair'][i], axis=1))[0][0]
-            first_cluster_id = self.workbench.loc[first_pair_idx, 'cluster']
-            second_cluster_id = self.workbench.loc[second_pair_idx, 'cluster']
+        ax = plt.gca()
+        ax.add_collection(LineCollection(np.concatenate(mst_segments), colors='green'))
+        if hull_segments:
+            ax.add_collection(LineCollection(np.concatenate(hull_segments), colors='gray', linestyles='--', linewidths=1))
 
-            closest_pair = None
-            min_distance = np.inf
+        # Connect each linked pair of clusters at their two closest points
+        connection_segments = []
+        for first_index, second_index in zip(self.connections['FirstIndex'], self.connections['SecondIndex']):
+            first_cluster_id = self.workbench.loc[first_index, 'cluster']
+            second_cluster_id = self.workbench.loc[second_index, 'cluster']
+            first_coords = all_embeddings[self.workbench[self.workbench['cluster'] == first_cluster_id].index]
+            second_coords = all_embeddings[self.workbench[self.workbench['cluster'] == second_cluster_id].index]
 
-            for point1 in all_embeddings[self.workbench[self.workbench['cluster'] == first_cluster_id].index]:
-                for point2 in all_embeddings[self.workbench[self.workbench['cluster'] == second_cluster_id].index]:
-                    distance = np.linalg.norm(point1 - point2)
-                    if distance < min_distance:
-                        min_distance = distance
-                        closest_pair = (point1, point2)
+            distances = scipy.spatial.distance.cdist(first_coords, second_coords)
+            i, j = np.unravel_index(np.argmin(distances), distances.shape)
+            connection_segments.append([first_coords[i], second_coords[j]])
 
-            if closest_pair is not None:
-                start_point, end_point = closest_pair
-                plt.plot([start_point[0], end_point[0]], [start_point[1], end_point[1]], color='purple', alpha=0.5)
+        if connection_segments:
+            ax.add_collection(LineCollection(connection_segments, colors='purple', alpha=0.5))
 
-        texts = []
-        for i, labels in enumerate(self.workbench['Label']):
-            text = plt.annotate(labels, (all_embeddings[i, 0], all_embeddings[i, 1]), fontsize=4, alpha=0.7, fontweight='bold')
-            texts.append(text)
+        if show_labels:
+            for i, labels in enumerate(self.workbench['Label']):
+                plt.annotate(labels, (all_embeddings[i, 0], all_embeddings[i, 1]), fontsize=4, alpha=0.7, fontweight='bold')
 
         plt.title('Clusters and Connections with Minimum Spanning Trees')
         plt.legend()
         plt.show()
 
 # Example usage
-client = OpenAI(api_key="apikey")
-csv_file = "chemistry.csv"
-max_cluster_depth = 2
-min_nodes= 10
-
-cluster_creator = ClusterCreator(max_cluster_depth, min_nodes)
-cluster_creator.load_skills_data_from_csv(csv_file)
-cluster_creator.make_clusters()
-cluster_creator.create_connections()
-cluster_creator.plot_clusters_and_connections_with_mst()
+if __name__ == "__main__":
+    csv_file = "chemistry.csv"
+    max_cluster_depth = 2
+    min_nodes= 10
+
+    cluster_creator = ClusterCreator(max_cluster_depth, min_nodes)
+    cluster_creator.load_skills_data_from_csv(csv_file)
+    cluster_creator.make_clusters()
+    cluster_creator.create_connections()
+    cluster_creator.plot_clusters_and_connections_with_mst()
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Column layout of the house table. The first six columns are read by position in heightHouses.cs, so new
+# columns may only be appended. Optional columns may be left off the end, as in the game's own umap_coords.csv.
+HOUSE_SCHEMA = [
+    {'name': 'x', 'type': 'float32', 'description': "World x of the house"},
+    {'name': 'y', 'type': 'float32', 'description': "World z of the house (CSV y is Unity z)"},
+    {'name': 'z', 'type': 'float64', 'description': "Terrain height, from the normalized view count"},
+    {'name': 'cluster', 'type': 'int64', 'description': "Cluster id"},
+    {'name': 'Label', 'type': 'string', 'description': "Video title"},
+    {'name': 'NormalizedTranscriptLength', 'type': 'float64', 'description': "Houses in the neighbourhood, 1-10"},
+    {'name': 'ClusterLabel', 'type': 'int64', 'description': "1-based cluster number in order of appearance",
+     'optional': True},
+]
+SCHEMA_VERSION = 1
+
+
+def clean_view_counts(view_counts):
+    """
+    Convert scraped view counts such as '"1,234"' to floats without touching the source column.
+    """
+    view_counts = pd.Series(view_counts)
+    if not pd.api.types.is_numeric_dtype(view_counts):
+        view_counts = view_counts.astype(str).str.replace(r'[,"]', '', regex=True)
+    return pd.to_numeric(view_counts, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def scale_to_range(values, low, high):
+    # Same result as MinMaxScaler(feature_range=(low, high)); a constant column maps to low
+    values = np.asarray(values, dtype=np.float64)
+    span = np.nanmax(values) - np.nanmin(values)
+    if span == 0:
+        return np.full_like(values, low)
+    return low + (values - np.nanmin(values)) * ((high - low) / span)
+
+
+def normalize_view_counts(view_counts, low=5, high=60, cap_outliers=True):
+    view_counts = clean_view_counts(view_counts)
+    if cap_outliers:
+        # Cap outliers at 1.5 IQR beyond the quartiles
+        q1, q3 = np.nanquantile(view_counts, [0.25, 0.75])
+        iqr = q3 - q1
+        view_counts = np.clip(view_counts, q1 - 1.5 * iqr, q3 + 1.5 * iqr)
+    return scale_to_range(view_counts, low, high)
+
+
+def normalize_transcript_lengths(lengths, low=1, high=10):
+    return scale_to_range(lengths, low, high).round()
+
+
+def number_clusters(cluster_ids):
+    # 1-based numbers in order of first appearance, matching label_clusters
+    codes, _ = pd.factorize(pd.Series(cluster_ids), sort=False)
+    return codes + 1
+
+
+def build_house_table(workbench, z_range=(5, 60), cap_outliers=True):
+    """
+    Build the exported house table from a pipeline workbench in one vectorized pass. Derived columns that the
+    workbench already has are kept. Missing ones are computed: x/y from 'umap_coords', z from 'ViewCount',
+    NormalizedTranscriptLength from 'TranscriptLength', and ClusterLabel from 'cluster'. Cluster ids must
+    already be integers, with every row in a cluster, so they match the ids in the MST CSV written alongside.
+    """
+    table = pd.DataFrame(index=workbench.index)
+    if 'x' in workbench and 'y' in workbench:
+        table['x'] = workbench['x'].to_numpy()
+        table['y'] = workbench['y'].to_numpy()
+    else:
+        coords = np.stack(workbench['umap_coords'].to_numpy())
+        table['x'] = coords[:, 0]
+        table['y'] = coords[:, 1]
+
+    if 'z' in workbench:
+        table['z'] = workbench['z'].to_numpy()
+    else:
+        table['z'] = normalize_view_counts(workbench['ViewCount'], *z_range, cap_outliers=cap_outliers)
+
+    clusters = workbench['cluster']
+    if clusters.isna().any():
+        raise ValueError(f"{int(clusters.isna().sum())} videos have no cluster, in "
+                         f"{describe_rows(workbench, clusters.isna().to_numpy())}")
+    if not pd.api.types.is_integer_dtype(clusters):
+        raise ValueError(f"Cluster ids must be integers, got {clusters.dtype}; number them before building the table")
+    table['cluster'] = clusters.to_numpy()
+    table['Label'] = workbench['Label'].to_numpy()
+
+    if 'NormalizedTranscriptLength' in workbench:
+        table['NormalizedTranscriptLength'] = workbench['NormalizedTranscriptLength'].to_numpy()
+    else:
+        table['NormalizedTranscriptLength'] = normalize_transcript_lengths(workbench['TranscriptLength'])
+
+    if 'ClusterLabel' in workbench:
+        table['ClusterLabel'] = workbench['ClusterLabel'].to_numpy()
+    else:
+        table['ClusterLabel'] = number_clusters(workbench['cluster'])
+
+    return apply_schema(table.reset_index(drop=True))
+
+
+def schema_columns(table):
+    """
+    Return the HOUSE_SCHEMA entries matching the table's columns, or None if they are not a valid layout:
+    every required column in schema order, followed by any prefix of the optional ones.
+    """
+    names = list(table.columns)
+    required = sum(not column.get('optional') for column in HOUSE_SCHEMA)
+    if len(names) < required or names != [column['name'] for column in HOUSE_SCHEMA[:len(names)]]:
+        return None
+    return HOUSE_SCHEMA[:len(names)]
+
+
+def apply_schema(table):
+    columns = schema_columns(table) or HOUSE_SCHEMA
+    return table.astype({column['name']: column['type'] for column in columns})[[column['name'] for column in columns]]
+
+
+def describe_rows(table, mask, limit=5):
+    # Name the offending rows by position and title, so a bad source row can be found
+    rows = np.flatnonzero(mask)
+    names = [f"{row} ({table['Label'].iloc[row]!r})" if 'Label' in table else str(row) for row in rows[:limit]]
+    more = f" and {len(rows) - limit} more" if len(rows) > limit else ""
+    return f"rows {', '.join(names)}{more}"
+
+
+def validate_houses(table):
+    """
+    Check a house table against HOUSE_SCHEMA. Raises ValueError listing every problem found.
+    """
+    problems = []
+    columns = schema_columns(table)
+    if columns is None:
+        expected = [column['name'] for column in HOUSE_SCHEMA]
+        problems.append(f"columns are {list(table.columns)}, expected {expected} (trailing optional columns may be left out)")
+    else:
+        for column in columns:
+            values = table[column['name']]
+            if values.isna().any():
+                problems.append(f"{column['name']} has {int(values.isna().sum())} missing values in "
+                                f"{describe_rows(table, values.isna().to_numpy())}")
+            if column['type'] == 'string':
+                if not (pd.api.types.is_string_dtype(values) or values.dtype == object):
+                    problems.append(f"{column['name']} is {values.dtype}, expected text")
+            elif values.dtype != np.dtype(column['type']):
+                problems.append(f"{column['name']} is {values.dtype}, expected {column['type']}")
+            else:
+                non_finite = ~np.isfinite(values.to_numpy(dtype=np.float64)) & values.notna().to_numpy()
+                if non_finite.any():
+                    problems.append(f"{column['name']} has non-finite values in {describe_rows(table, non_finite)}")
+    if problems:
+        raise ValueError("Invalid house table: " + "; ".join(problems))
+
+
+def arrow_schema(columns=HOUSE_SCHEMA):
+    import pyarrow as pa
+
+    types = {'float32': pa.float32(), 'float64': pa.float64(), 'int64': pa.int64(), 'string': pa.string()}
+    return pa.schema([pa.field(column['name'], types[column['type']], nullable=False) for column in columns],
+                     metadata={'schema_version': str(SCHEMA_VERSION)})
+
+
+def write_house_table(table, output_base):
+    """
+    Validate the table once, then write <output_base>.csv for the game's loaders, <output_base>.parquet for fast
+    columnar reads (when pyarrow is installed), and <output_base>.schema.json describing the columns written.
+    """
+    validate_houses(table)
+    directory = os.path.dirname(output_base)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    table.to_csv(f"{output_base}.csv", index=False)
+    written = [f"{output_base}.csv"]
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("pyarrow is not installed, skipping the Parquet export")
+    else:
+        pq.write_table(pa.Table.from_pandas(table, schema=arrow_schema(schema_columns(table)), preserve_index=False), f"{output_base}.parquet")
+        written.append(f"{output_base}.parquet")
+
+    with open(f"{output_base}.schema.json", 'w', encoding='utf-8') as f:
+        json.dump({'version': SCHEMA_VERSION, 'columns': schema_columns(table)}, f, indent=2)
+    print(f"House table saved to {', '.join(written)}")
+
+
+def read_house_table(path):
+    table = pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path, encoding='utf-8')
+    # CSV carries no types, so cast before checking. Integer columns with blanks cannot be cast and are left for
+    # validate_houses to report
+    if path.endswith('.csv') and schema_columns(table) is not None:
+        table = table.astype({column['name']: column['type'] for column in schema_columns(table)
+                              if not (column['type'] == 'int64' and table[column['name']].isna().any())})
+    validate_houses(table)
+    return table
+
+
+# Example usage:
+#   python map_export.py umap_coordinates.csv
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate exported house tables against the declared schema.")
+    parser.add_argument('paths', nargs='+', help="House tables to check (.csv or .parquet)")
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.paths:
+        try:
+            table = read_house_table(path)
+            print(f"{path}: OK, {len(table)} houses")
+        except (ValueError, KeyError) as e:
+            print(f"{path}: {e}")
+            failed = True
+    raise SystemExit(1 if failed else 0)
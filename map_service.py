@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from Cluster import build_map
+from embedding_cache import EmbeddingCache
+
+
+def warm_up():
+    """
+    Fit UMAP and KMeans once on random data so numba compiles its kernels before the first real job.
+    """
+    from sklearn.cluster import KMeans
+    from umap import UMAP
+
+    start = time.perf_counter()
+    sample = np.random.default_rng(0).normal(size=(64, 16))
+    UMAP(n_neighbors=10, min_dist=0.1, n_components=2, metric='cosine').fit_transform(sample)
+    KMeans(n_clusters=2, random_state=42, n_init=1).fit(sample)
+    print(f"Warm-up finished in {time.perf_counter() - start:.1f}s")
+
+
+class MapBuildService:
+    def __init__(self, embedding_cache_path=None):
+        self.embedding_cache_path = embedding_cache_path
+        self.jobs = {}
+        self.job_queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.worker = threading.Thread(target=self.run_worker, daemon=True)
+
+    def start(self):
+        self.worker.start()
+
+    def submit(self, csv_file, output_dir, max_cluster_depth=2, min_nodes=10, tile_size=None, profile_stage=None):
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'csv_file': csv_file,
+            'output_dir': output_dir,
+            'max_cluster_depth': max_cluster_depth,
+            'min_nodes': min_nodes,
+            'tile_size': tile_size,
+            'profile_stage': profile_stage,
+            'submitted_at': time.time(),
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+        self.job_queue.put(job_id)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list(self):
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def run_worker(self):
+        # Builds run one at a time; UMAP and KMeans already use every core.
+        # The cache is opened here because SQLite connections belong to the thread that made them.
+        cache = EmbeddingCache(self.embedding_cache_path) if self.embedding_cache_path else None
+        while True:
+            job_id = self.job_queue.get()
+            job = self.get(job_id)
+            self.update(job_id, status='running', started_at=time.time())
+            try:
+                build_map(job['csv_file'], job['output_dir'], job['max_cluster_depth'], job['min_nodes'],
+                          embedding_cache=cache, tile_size=job['tile_size'], profile_stage=job['profile_stage'])
+                self.update(job_id, status='done', finished_at=time.time(),
+                            report=os.path.join(job['output_dir'], 'run_report.json'))
+            except Exception as e:
+                traceback.print_exc()
+                self.update(job_id, status='failed', finished_at=time.time(), error=str(e))
+            finally:
+                self.job_queue.task_done()
+
+
+def parse_job_options(request):
+    """
+    Read the optional fields of a job request, raising ValueError naming the first bad one.
+    """
+    options = {}
+    for field, default in (('max_cluster_depth', 2), ('min_nodes', 10)):
+        value = request.get(field, default)
+        # bool is a subclass of int, but true/false is never a meaningful count
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ValueError(f"{field} must be a positive integer, got {value!r}")
+        options[field] = value
+
+    tile_size = request.get('tile_size')
+    if tile_size is not None and (isinstance(tile_size, bool) or not isinstance(tile_size, (int, float))
+                                  or not 0 < tile_size < float('inf')):
+        raise ValueError(f"tile_size must be a positive number or null, got {tile_size!r}")
+    options['tile_size'] = tile_size
+
+    profile_stage = request.get('profile_stage')
+    if profile_stage is not None and (not isinstance(profile_stage, str) or not profile_stage):
+        raise ValueError(f"profile_stage must be a stage name or null, got {profile_stage!r}")
+    options['profile_stage'] = profile_stage
+
+    output_dir = request.get('output_dir')
+    if output_dir is not None and (not isinstance(output_dir, str) or not output_dir):
+        raise ValueError(f"output_dir must be a non-empty path or left out, got {output_dir!r}")
+    options['output_dir'] = output_dir
+    return options
+
+
+def make_handler(service):
+    class MapBuildHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, payload):
+            body = json.dumps(payload, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self.send_json(200, {'status': 'ok', 'queued': service.job_queue.qsize()})
+            elif self.path == '/jobs':
+                self.send_json(200, service.list())
+            elif self.path.startswith('/jobs/'):
+                job = service.get(self.path[len('/jobs/'):])
+                if job is None:
+                    self.send_json(404, {'error': 'Unknown job'})
+                else:
+                    self.send_json(200, job)
+            else:
+                self.send_json(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            if self.path != '/jobs':
+                self.send_json(404, {'error': 'Not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                csv_file = request['csv_file']
+            except (ValueError, KeyError, TypeError):
+                self.send_json(400, {'error': 'Expected a JSON body with a csv_file field'})
+                return
+
+            try:
+                options = parse_job_options(request)
+            except ValueError as e:
+                self.send_json(400, {'error': str(e)})
+                return
+
+            if not isinstance(csv_file, str) or not os.path.isfile(csv_file):
+                self.send_json(400, {'error': f'CSV file not found: {csv_file}'})
+                return
+
+            output_dir = options.pop('output_dir') or os.path.splitext(csv_file)[0] + '_map'
+            job = service.submit(csv_file, output_dir, **options)
+            self.send_json(202, job)
+
+    return MapBuildHandler
+
+
+def serve(host='127.0.0.1', port=8765, warm=True, embedding_cache_path=None):
+    if warm:
+        warm_up()
+    service = MapBuildService(embedding_cache_path)
+    service.start()
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Map build service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Example usage:
+#   python map_service.py --port 8765
+#   curl -X POST localhost:8765/jobs -d '{"csv_file": "chemistry3.csv", "output_dir": "chemistry3_map"}'
+#   curl -X POST localhost:8765/jobs -d '{"csv_file": "chemistry3.csv", "profile_stage": "umap"}'
+#   curl localhost:8765/jobs/<id>
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the map build pipeline warm and run builds from a queue.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--no-warm-up', action='store_true', help="Skip the UMAP/KMeans warm-up fit")
+    parser.add_argument('--embedding-cache', default=None, help="SQLite file to reuse embeddings across builds")
+    args = parser.parse_args()
+    serve(args.host, args.port, warm=not args.no_warm_up, embedding_cache_path=args.embedding_cache)
@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from render import square_bounds, square_raster
+
+
+def downsample(image):
+    # Average each 2x2 block of pixels
+    height, width, channels = image.shape
+    return image.reshape(height // 2, 2, width // 2, 2, channels).mean(axis=(1, 3))
+
+
+def bake_pyramid(houses, mst, output_dir, cluster_names=None, levels=4, tile_px=256, padding=100):
+    """
+    Rasterise the final map (cluster regions, roads, houses and cluster names) tile by tile at the highest
+    zoom level, and build each coarser tile by averaging the 2x2 tiles below it. Tiles are saved as
+    <level>/<col>/<row>.png. Level 0 is a single tile covering the whole map, and row 0 is the top row,
+    as in web map tiles. manifest.json holds the world bounds and the world-to-pixel transform of every
+    level, so the minimap is a texture lookup whose cost does not grow with house count.
+    As in the game, CSV y is world z.
+
+    Only one tile_px canvas is drawn, with its view moved from tile to tile, and the coarser levels are
+    built depth first. Memory therefore stays at a few tiles per level, however deep the pyramid.
+    """
+    from matplotlib.image import imsave
+
+    if levels < 1:
+        raise ValueError(f"levels must be at least 1, got {levels}")
+
+    bounds = square_bounds(houses, padding)
+    world_size = bounds[2] - bounds[0]
+    finest = levels - 1
+    finest_tiles = 2 ** finest
+    tile_world = world_size / finest_tiles
+
+    # Artists are built once; each finest tile only moves the view. Names are sized as if the finest level were
+    # one canvas, so they stay readable once the coarse levels shrink them
+    figure = square_raster(houses, mst, [bounds[0], bounds[3] - tile_world, bounds[0] + tile_world, bounds[3]], tile_px,
+                           cluster_names=cluster_names, fill_regions=True, show_names=True,
+                           name_fontsize=max(6, tile_px * finest_tiles / 150))
+    ax = figure.axes[0]
+    # Drawing a large name costs far more than the rest of a tile, so each name is only drawn on the tiles it
+    # reaches. Tiles at the finest level share one scale, so a name's extent in world units is the same on all
+    name_extents = [text.get_window_extent(figure.canvas.get_renderer()).transformed(ax.transData.inverted())
+                    for text in ax.texts]
+
+    def save(level, col, row, tile):
+        os.makedirs(os.path.join(output_dir, str(level), str(col)), exist_ok=True)
+        imsave(os.path.join(output_dir, str(level), str(col), f"{row}.png"), tile)
+
+    def bake(level, col, row):
+        if level == finest:
+            x_range = (bounds[0] + col * tile_world, bounds[0] + (col + 1) * tile_world)
+            y_range = (bounds[3] - (row + 1) * tile_world, bounds[3] - row * tile_world)
+            ax.set_xlim(*x_range)
+            ax.set_ylim(*y_range)
+            for text, extent in zip(ax.texts, name_extents):
+                text.set_visible(extent.x1 >= x_range[0] and extent.x0 <= x_range[1]
+                                 and extent.y1 >= y_range[0] and extent.y0 <= y_range[1])
+            figure.canvas.draw()
+            tile = np.array(figure.canvas.buffer_rgba(), dtype=np.uint8)
+        else:
+            block = np.concatenate([
+                np.concatenate([bake(level + 1, 2 * col + dx, 2 * row + dy) for dy in (0, 1)], axis=0)
+                for dx in (0, 1)
+            ], axis=1)
+            tile = downsample(block.astype(np.float32)).round().astype(np.uint8)
+        save(level, col, row, tile)
+        return tile
+
+    bake(0, 0, 0)
+
+    manifest_levels = []
+    for level in range(levels):
+        tiles_per_side = 2 ** level
+        size_px = tile_px * tiles_per_side
+        scale = size_px / world_size
+        manifest_levels.append({
+            'level': level,
+            'size_px': size_px,
+            'tiles_per_side': tiles_per_side,
+            'world_units_per_pixel': world_size / size_px,
+            # pixel_x = a * x + b and pixel_y = c * y + d, measured from the top-left corner of the level
+            'world_to_pixel': {'a': scale, 'b': -bounds[0] * scale, 'c': -scale, 'd': bounds[3] * scale},
+        })
+
+    manifest = {
+        'bounds': bounds,
+        'tile_px': tile_px,
+        'levels': manifest_levels,
+        'tile_path': '{level}/{col}/{row}.png',
+    }
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Minimap pyramid with {levels} levels saved to {output_dir}")
+    return manifest
+
+
+# Example usage:
+#   python minimap_pyramid.py umap_coords.csv mst_edges.csv --levels 4 --output-dir minimap
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bake a multi-resolution minimap tile pyramid from a finished map.")
+    parser.add_argument('houses_csv')
+    parser.add_argument('mst_csv')
+    parser.add_argument('--levels', type=int, default=4)
+    parser.add_argument('--tile-px', type=int, default=256)
+    parser.add_argument('--output-dir', default='minimap')
+    args = parser.parse_args()
+
+    bake_pyramid(pd.read_csv(args.houses_csv), pd.read_csv(args.mst_csv), args.output_dir,
+                 levels=args.levels, tile_px=args.tile_px)
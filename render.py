@@ -0,0 +1,166 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import ConvexHull
+
+from tile_export import edge_endpoints
+
+
+def new_figure(width_px, height_px, dpi=100):
+    # Uses the Agg canvas directly instead of pyplot, so rendering needs no display and keeps no global figure state
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(width_px / dpi, height_px / dpi), dpi=dpi)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def cluster_colors(cluster_ids):
+    import matplotlib
+
+    unique_clusters = pd.unique(cluster_ids)
+    palette = matplotlib.colormaps['rainbow'](np.linspace(0, 1, len(unique_clusters)))
+    codes = pd.Index(unique_clusters).get_indexer(cluster_ids)
+    return unique_clusters, palette, palette[codes]
+
+
+def hull_segments(houses):
+    segments = []
+    for _, cluster_houses in houses.groupby('cluster'):
+        coords = cluster_houses[['x', 'y']].to_numpy(dtype=np.float64)
+        if len(coords) >= 3:
+            hull = ConvexHull(coords)
+            segments.append(coords[hull.simplices])
+    return np.concatenate(segments) if segments else np.empty((0, 2, 2))
+
+
+def hull_polygons(houses):
+    polygons, cluster_ids = [], []
+    for cluster_id, cluster_houses in houses.groupby('cluster', sort=False):
+        coords = cluster_houses[['x', 'y']].to_numpy(dtype=np.float64)
+        if len(coords) >= 3:
+            polygons.append(coords[ConvexHull(coords).vertices])
+            cluster_ids.append(cluster_id)
+    return polygons, cluster_ids
+
+
+def draw_map(ax, houses, mst, cluster_names=None, point_size=20, show_hulls=True, show_names=True, show_labels=False,
+             fill_regions=False, name_fontsize=10):
+    """
+    Draw houses, MST roads and cluster outlines onto ax, using one collection per layer
+    instead of one artist per element.
+    """
+    from matplotlib.collections import LineCollection, PolyCollection
+
+    x = houses['x'].to_numpy(dtype=np.float64)
+    y = houses['y'].to_numpy(dtype=np.float64)
+    unique_clusters, palette, point_colors = cluster_colors(houses['cluster'].to_numpy())
+
+    if fill_regions:
+        polygons, region_clusters = hull_polygons(houses)
+        if polygons:
+            region_colors = palette[pd.Index(unique_clusters).get_indexer(region_clusters)]
+            ax.add_collection(PolyCollection(polygons, facecolors=region_colors, edgecolors='none', alpha=0.25))
+
+    edges, start, end = edge_endpoints(houses, mst)
+    if len(edges):
+        edge_colors = palette[pd.Index(unique_clusters).get_indexer(edges['ClusterID'].to_numpy())]
+        ax.add_collection(LineCollection(np.stack([start, end], axis=1), colors=edge_colors, linewidths=1.5, alpha=0.5))
+
+    if show_hulls:
+        segments = hull_segments(houses)
+        if len(segments):
+            ax.add_collection(LineCollection(segments, colors='gray', linestyles='--', linewidths=1, alpha=0.8))
+
+    ax.scatter(x, y, c=point_colors, s=point_size, alpha=0.7, linewidths=0)
+
+    if show_names:
+        cluster_names = cluster_names or {}
+        centroids = houses.groupby('cluster')[['x', 'y']].mean()
+        for cluster_id, centroid in centroids.iterrows():
+            ax.text(centroid['x'], centroid['y'], cluster_names.get(cluster_id, f"Cluster {cluster_id}"),
+                    fontsize=name_fontsize, fontweight='bold', ha='center')
+
+    if show_labels:
+        for label, label_x, label_y in zip(houses['Label'], x, y):
+            ax.text(label_x, label_y, label, fontsize=4, alpha=0.7)
+
+    ax.set_aspect('equal')
+    ax.autoscale_view()
+
+
+def render_preview(houses, mst, output_file, cluster_names=None, width_px=1500, height_px=1000, dpi=100, show_labels=False):
+    """
+    Write a preview of the map to output_file. The format follows the extension (.png, .svg, .pdf).
+    """
+    figure = new_figure(width_px, height_px, dpi)
+    ax = figure.add_subplot()
+    draw_map(ax, houses, mst, cluster_names, show_labels=show_labels)
+    ax.set_xlabel('x')
+    ax.set_ylabel('y (world z)')
+    ax.set_title('Clusters with Minimum Spanning Trees and Convex Hulls')
+    figure.tight_layout()
+    figure.savefig(output_file)
+    print(f"Preview saved to {output_file}")
+
+
+def render_minimap(houses, mst, output_file, resolution=512, padding=100):
+    """
+    Rasterise the map to a square, axis-free image of resolution x resolution pixels for use as a minimap texture.
+    Returns the world bounds [min_x, min_y, max_x, max_y] that the image edges map to. Image up is +y (world +z).
+    """
+    if resolution < 1:
+        raise ValueError(f"resolution must be at least 1 pixel, got {resolution}")
+    bounds = square_bounds(houses, padding)
+    figure = square_raster(houses, mst, bounds, resolution)
+    figure.savefig(output_file, dpi=100)
+    print(f"Minimap saved to {output_file}")
+    return bounds
+
+
+def square_bounds(houses, padding=100):
+    x = houses['x'].to_numpy(dtype=np.float64)
+    y = houses['y'].to_numpy(dtype=np.float64)
+    center_x = (x.min() + x.max()) / 2
+    center_y = (y.min() + y.max()) / 2
+    half_extent = max(x.max() - x.min(), y.max() - y.min()) / 2 + padding
+    return [float(center_x - half_extent), float(center_y - half_extent),
+            float(center_x + half_extent), float(center_y + half_extent)]
+
+
+def square_raster(houses, mst, bounds, resolution, **draw_options):
+    """
+    Draw the map onto an axis-free resolution x resolution figure whose edges are exactly bounds.
+    """
+    figure = new_figure(resolution, resolution)
+    ax = figure.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    # Keep house markers about 30 world units across whatever the resolution (scatter sizes are in points squared)
+    marker_px = resolution / (bounds[2] - bounds[0]) * 30
+    draw_options.setdefault('show_names', False)
+    draw_map(ax, houses, mst, point_size=max(1.0, (marker_px * 72 / 100) ** 2), **draw_options)
+    ax.set_xlim(bounds[0], bounds[2])
+    ax.set_ylim(bounds[1], bounds[3])
+    return figure
+
+
+# Example usage:
+#   python render.py umap_coords.csv mst_edges.csv --output-dir previews --minimap-resolution 1024
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render map previews and a minimap raster without a display.")
+    parser.add_argument('houses_csv')
+    parser.add_argument('mst_csv')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--minimap-resolution', type=int, default=512)
+    parser.add_argument('--labels', action='store_true', help="Also draw every video title on the preview")
+    args = parser.parse_args()
+
+    houses = pd.read_csv(args.houses_csv)
+    mst = pd.read_csv(args.mst_csv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    render_preview(houses, mst, os.path.join(args.output_dir, 'preview.png'), show_labels=args.labels)
+    render_preview(houses, mst, os.path.join(args.output_dir, 'preview.svg'), show_labels=args.labels)
+    render_minimap(houses, mst, os.path.join(args.output_dir, 'minimap.png'), args.minimap_resolution)
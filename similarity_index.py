@@ -0,0 +1,258 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def check_k(k):
+    if k < 1:
+        raise ValueError(f"k must be at least 1, got {k}")
+
+
+class SimilarityIndex:
+    """
+    Inverted-file (IVF) index over normalized video embeddings. The vectors are split into lists by a
+    KMeans coarse quantizer, and a query only scores the lists whose centroids are closest to it.
+    Scores are cosine similarities.
+    """
+
+    def __init__(self, vectors, labels, coords, centroids, order, offsets, n_probe, recall=None):
+        self.vectors = vectors
+        self.labels = np.asarray(labels, dtype=object)
+        self.coords = coords  # x, y, z of each video's house, as in umap_coords.csv
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.n_probe = n_probe
+        self.recall = recall  # recall@10 measured for n_probe when the index was built, if it was calibrated
+        self.label_index = {label: i for i, label in enumerate(self.labels)}
+
+    @classmethod
+    def build(cls, embeddings, labels, coords, n_lists=None, n_probe=None, seed=42, target_recall=0.95):
+        """
+        Build the index. Unless n_probe is given, it is calibrated: the smallest number of probed lists
+        whose recall@10 on the stored videos reaches target_recall.
+        """
+        from sklearn.cluster import KMeans
+
+        vectors = normalize_rows(np.stack(embeddings))
+        n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+        kmeans = KMeans(n_clusters=n_lists, random_state=seed, n_init=1).fit(vectors)
+        centroids = normalize_rows(kmeans.cluster_centers_)
+
+        # Store each list's members contiguously: order[offsets[l]:offsets[l + 1]] are the rows in list l
+        assignments = kmeans.labels_
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+        index = cls(vectors, labels, np.asarray(coords, dtype=np.float32), centroids, order, offsets, n_probe or n_lists)
+        if n_probe is None:
+            index.calibrate(target_recall, seed=seed)
+        return index
+
+    def calibrate(self, target_recall=0.95, k=10, n_queries=200, seed=0):
+        """
+        Set n_probe to the fewest lists that reach target_recall at k, using stored videos as queries.
+        Recall can only grow with n_probe, so this is a binary search. Probing every list is an exact search.
+        """
+        queries = sample_queries(self, n_queries, seed)
+        expected = [self.brute_force(self.vectors[row], k, exclude=row)[0] for row in queries]
+        low, high = 1, len(self.centroids)
+        recall_at = {high: 1.0}
+        while low < high:
+            middle = (low + high) // 2
+            recall_at[middle] = measure_recall(self, queries, expected, k, middle)
+            if recall_at[middle] >= target_recall:
+                high = middle
+            else:
+                low = middle + 1
+        self.n_probe = high
+        self.recall = recall_at[high]
+        print(f"Similarity index probes {self.n_probe} of {len(self.centroids)} lists "
+              f"for recall@{k} {self.recall:.3f} (target {target_recall})")
+
+    def save(self, path):
+        np.savez(path, vectors=self.vectors, labels=self.labels.astype(str), coords=self.coords,
+                 centroids=self.centroids, order=self.order, offsets=self.offsets, n_probe=self.n_probe,
+                 recall=np.nan if self.recall is None else self.recall)
+        print(f"Similarity index saved to {path}")
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        # Indexes saved before calibration existed have no recall entry
+        recall = float(data['recall']) if 'recall' in data.files and not np.isnan(data['recall']) else None
+        return cls(data['vectors'], data['labels'], data['coords'], data['centroids'],
+                   data['order'], data['offsets'], int(data['n_probe']), recall)
+
+    def search(self, query, k=10, n_probe=None, exclude=None):
+        """
+        Return the row indices and scores of the k vectors most similar to query, best first. At least
+        n_probe lists are scored, and more are added, nearest first, until they hold k candidates.
+        """
+        check_k(k)
+        query = normalize_rows(query)
+        nearest_lists = np.argsort(-(self.centroids @ query))
+        list_sizes = np.cumsum(np.diff(self.offsets)[nearest_lists])
+        # One extra candidate in case the excluded row is among them
+        needed = k + (exclude is not None)
+        n_probe = max(n_probe or self.n_probe, int(np.searchsorted(list_sizes, needed)) + 1)
+        probed = nearest_lists[:min(n_probe, len(nearest_lists))]
+        candidates = np.concatenate([self.order[self.offsets[l]:self.offsets[l + 1]] for l in probed])
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        return self.top_k(candidates, self.vectors[candidates] @ query, k)
+
+    def brute_force(self, query, k=10, exclude=None):
+        check_k(k)
+        candidates = np.arange(len(self.vectors))
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        return self.top_k(candidates, self.vectors[candidates] @ normalize_rows(query), k)
+
+    @staticmethod
+    def top_k(candidates, scores, k):
+        k = min(k, len(candidates))
+        if k == 0:
+            return candidates[:0], scores[:0]
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return candidates[best], scores[best]
+
+    def similar_to(self, label, k=10, n_probe=None):
+        """
+        Find the k videos most similar to the one titled label, with their house coordinates.
+        """
+        if label not in self.label_index:
+            raise KeyError(f"Unknown video: {label}")
+        row = self.label_index[label]
+        indices, scores = self.search(self.vectors[row], k, n_probe, exclude=row)
+        return [{'Label': self.labels[i], 'score': float(score),
+                 'x': float(self.coords[i, 0]), 'y': float(self.coords[i, 1]), 'z': float(self.coords[i, 2])}
+                for i, score in zip(indices, scores)]
+
+
+def sample_queries(index, n_queries, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.choice(len(index.vectors), size=min(n_queries, len(index.vectors)), replace=False)
+
+
+def measure_recall(index, queries, expected, k, n_probe):
+    recalls = [len(np.intersect1d(index.search(index.vectors[row], k, n_probe, exclude=row)[0], exact)) / len(exact)
+               for row, exact in zip(queries, expected) if len(exact)]
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+def benchmark_recall(index, k=10, n_queries=200, n_probe=None, seed=0):
+    """
+    Compare the index with an exact search over every vector, using stored videos as queries.
+    Reports mean recall@k and per-query latency for both.
+    """
+    queries = sample_queries(index, n_queries, seed)
+    recalls, index_latencies, exact_latencies = [], [], []
+    for row in queries:
+        start = time.perf_counter()
+        found, _ = index.search(index.vectors[row], k, n_probe, exclude=row)
+        index_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        expected, _ = index.brute_force(index.vectors[row], k, exclude=row)
+        exact_latencies.append(time.perf_counter() - start)
+
+        if len(expected):
+            recalls.append(len(np.intersect1d(found, expected)) / len(expected))
+
+    result = {
+        'k': k,
+        'queries': len(queries),
+        'n_probe': n_probe or index.n_probe,
+        'n_lists': len(index.centroids),
+        'recall': float(np.mean(recalls)) if recalls else None,
+        'index_p50_ms': float(np.percentile(index_latencies, 50) * 1000),
+        'index_p99_ms': float(np.percentile(index_latencies, 99) * 1000),
+        'exact_p50_ms': float(np.percentile(exact_latencies, 50) * 1000),
+        'exact_p99_ms': float(np.percentile(exact_latencies, 99) * 1000),
+    }
+    print(f"recall@{k}: {result['recall']:.3f} "
+          f"(index p50 {result['index_p50_ms']:.3f} ms, exact p50 {result['exact_p50_ms']:.3f} ms)")
+    return result
+
+
+def make_handler(index):
+    class SimilarityHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/similar':
+                self.send_json(404, {'error': 'Not found'})
+                return
+            params = parse_qs(url.query)
+            if 'label' not in params:
+                self.send_json(400, {'error': 'Expected a label query parameter'})
+                return
+            try:
+                k = int(params.get('k', ['10'])[0])
+            except ValueError:
+                self.send_json(400, {'error': 'k must be an integer'})
+                return
+            if k < 1:
+                self.send_json(400, {'error': 'k must be at least 1'})
+                return
+            try:
+                self.send_json(200, index.similar_to(params['label'][0], k))
+            except KeyError as e:
+                self.send_json(404, {'error': str(e.args[0])})
+
+    return SimilarityHandler
+
+
+def serve(index_file, host='127.0.0.1', port=8766):
+    index = SimilarityIndex.load(index_file)
+    server = ThreadingHTTPServer((host, port), make_handler(index))
+    print(f"Similarity service for {len(index.vectors)} videos listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Example usage:
+#   python similarity_index.py serve similar_videos.npz --port 8766
+#   curl "localhost:8766/similar?label=Introduction%20to%20Moles%20-%20AP%20Chem%20Unit%201,%20Topic%201a&k=5"
+#   python similarity_index.py benchmark similar_videos.npz --k 10
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve or benchmark a similar-video index.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('index_file')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8766)
+    benchmark_parser = subparsers.add_parser('benchmark')
+    benchmark_parser.add_argument('index_file')
+    benchmark_parser.add_argument('--k', type=int, default=10)
+    benchmark_parser.add_argument('--queries', type=int, default=200)
+    benchmark_parser.add_argument('--n-probe', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.index_file, args.host, args.port)
+    else:
+        benchmark_recall(SimilarityIndex.load(args.index_file), args.k, args.queries, args.n_probe)
@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def edge_endpoints(houses, mst):
+    """
+    Look up the coordinates of both ends of every MST edge. Labels are resolved the way the game does,
+    with later rows winning. Edges whose houses are missing are dropped.
+    Returns the kept edges and their start and end coordinates.
+    """
+    mst = mst.rename(columns={mst.columns[0]: 'ClusterID'})
+    positions = houses.drop_duplicates('Label', keep='last').set_index('Label')[['x', 'y']]
+    mst = mst[mst['StartNode'].isin(positions.index) & mst['EndNode'].isin(positions.index)].reset_index(drop=True)
+    start = positions.loc[mst['StartNode']].to_numpy(dtype=np.float64)
+    end = positions.loc[mst['EndNode']].to_numpy(dtype=np.float64)
+    return mst, start, end
+
+
+def assign_house_tiles(x, y, origin, tile_size):
+    cols = np.floor((x - origin[0]) / tile_size).astype(np.int64)
+    rows = np.floor((y - origin[1]) / tile_size).astype(np.int64)
+    return cols, rows
+
+
+def assign_edge_tiles(start, end, origin, tile_size):
+    """
+    Find every tile each road segment passes through. Returns parallel arrays of edge index,
+    tile column and tile row.
+    """
+    low = np.minimum(start, end)
+    high = np.maximum(start, end)
+    first_cols, first_rows = assign_house_tiles(low[:, 0], low[:, 1], origin, tile_size)
+    last_cols, last_rows = assign_house_tiles(high[:, 0], high[:, 1], origin, tile_size)
+
+    # Candidate tiles are those under each segment's bounding box; roads are short, so usually only one or two
+    span_cols = last_cols - first_cols + 1
+    span_rows = last_rows - first_rows + 1
+    counts = span_cols * span_rows
+    edge_index = np.repeat(np.arange(len(start)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cols = first_cols[edge_index] + offsets % span_cols[edge_index]
+    rows = first_rows[edge_index] + offsets // span_cols[edge_index]
+
+    # Keep only candidates whose box the segment actually crosses (Liang-Barsky clipping)
+    tile_low = np.stack([origin[0] + cols * tile_size, origin[1] + rows * tile_size], axis=1)
+    tile_high = tile_low + tile_size
+    p0 = start[edge_index]
+    direction = end[edge_index] - p0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_low = (tile_low - p0) / direction
+        t_high = (tile_high - p0) / direction
+    t_enter = np.where(direction == 0, -np.inf, np.minimum(t_low, t_high))
+    t_exit = np.where(direction == 0, np.inf, np.maximum(t_low, t_high))
+    # A segment parallel to an axis only crosses the tile if it lies within that slab
+    inside_slab = (direction != 0) | ((p0 >= tile_low) & (p0 <= tile_high))
+    enter = np.maximum(t_enter.max(axis=1), 0)
+    exit_ = np.minimum(t_exit.min(axis=1), 1)
+    crosses = inside_slab.all(axis=1) & (enter <= exit_)
+    return edge_index[crosses], cols[crosses], rows[crosses]
+
+
+def export_tiles(houses, mst, output_dir, tile_size=1000, cluster_names=None):
+    """
+    Partition a finished map into a fixed grid of tiles so the game can stream only the regions near the player.
+
+    houses has the umap_coords.csv columns (x, y, z, cluster, Label, NormalizedTranscriptLength) and mst the
+    mst_edges.csv columns (ClusterID, StartNode, EndNode). Each non-empty tile gets a houses and an edges CSV
+    in the same layout, so the existing loaders can read a single tile. Edge rows also carry their endpoint
+    coordinates, so a road can be drawn even when the tile holding the house at its far end is not loaded.
+    index.json lists each tile's bounding box and files, plus per-cluster metadata. As in the game,
+    CSV y is world z.
+    """
+    cluster_names = cluster_names or {}
+    os.makedirs(output_dir, exist_ok=True)
+
+    houses = houses.reset_index(drop=True)
+    x = houses['x'].to_numpy(dtype=np.float64)
+    y = houses['y'].to_numpy(dtype=np.float64)
+    origin = (np.floor(x.min() / tile_size) * tile_size, np.floor(y.min() / tile_size) * tile_size)
+
+    cols, rows = assign_house_tiles(x, y, origin, tile_size)
+    houses = houses.assign(TileCol=cols, TileRow=rows)
+
+    mst, start, end = edge_endpoints(houses, mst)
+    mst = mst.assign(StartX=start[:, 0], StartY=start[:, 1], EndX=end[:, 0], EndY=end[:, 1])
+    edge_index, edge_cols, edge_rows = assign_edge_tiles(start, end, origin, tile_size)
+    edge_tiles = mst.iloc[edge_index].assign(TileCol=edge_cols, TileRow=edge_rows)
+
+    house_columns = [column for column in houses.columns if column not in ('TileCol', 'TileRow')]
+    edge_columns = ['ClusterID', 'StartNode', 'EndNode', 'StartX', 'StartY', 'EndX', 'EndY']
+    house_groups = dict(list(houses.groupby(['TileCol', 'TileRow'])))
+    edge_groups = dict(list(edge_tiles.groupby(['TileCol', 'TileRow'])))
+
+    tiles = []
+    for col, row in sorted(set(house_groups) | set(edge_groups)):
+        tile_id = f"{col}_{row}"
+        tile_houses = house_groups.get((col, row), houses.iloc[:0])
+        tile_edges = edge_groups.get((col, row), edge_tiles.iloc[:0])
+        houses_file = f"tile_{tile_id}_houses.csv"
+        edges_file = f"tile_{tile_id}_edges.csv"
+        tile_houses[house_columns].to_csv(os.path.join(output_dir, houses_file), index=False)
+        tile_edges[edge_columns].to_csv(os.path.join(output_dir, edges_file), index=False)
+
+        min_x = origin[0] + col * tile_size
+        min_y = origin[1] + row * tile_size
+        tiles.append({
+            'id': tile_id,
+            'col': int(col),
+            'row': int(row),
+            'bounds': [min_x, min_y, min_x + tile_size, min_y + tile_size],
+            'houses_file': houses_file,
+            'edges_file': edges_file,
+            'house_count': len(tile_houses),
+            'edge_count': len(tile_edges),
+            'clusters': {str(cluster_id): int(count) for cluster_id, count in tile_houses['cluster'].value_counts().items()},
+        })
+
+    clusters = []
+    for cluster_id, cluster_houses in houses.groupby('cluster'):
+        clusters.append({
+            'cluster': str(cluster_id),
+            'name': cluster_names.get(cluster_id, f"Cluster {cluster_id}"),
+            'house_count': len(cluster_houses),
+            'centroid': [float(cluster_houses['x'].mean()), float(cluster_houses['y'].mean())],
+            'bounds': [float(cluster_houses['x'].min()), float(cluster_houses['y'].min()),
+                       float(cluster_houses['x'].max()), float(cluster_houses['y'].max())],
+            'tiles': sorted(f"{col}_{row}" for col, row in cluster_houses[['TileCol', 'TileRow']].drop_duplicates().itertuples(index=False)),
+        })
+
+    index = {
+        'tile_size': tile_size,
+        'origin': [float(origin[0]), float(origin[1])],
+        'bounds': [float(x.min()), float(y.min()), float(x.max()), float(y.max())],
+        'house_count': len(houses),
+        'edge_count': len(mst),
+        'tiles': tiles,
+        'clusters': clusters,
+    }
+    index_file = os.path.join(output_dir, 'index.json')
+    with open(index_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    print(f"{len(tiles)} tiles saved to {output_dir}")
+    return index
+
+
+# Example usage:
+#   python tile_export.py umap_coords.csv mst_edges.csv --tile-size 1000 --output-dir tiles
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a map's house and MST CSVs into a grid of streamable tiles.")
+    parser.add_argument('houses_csv')
+    parser.add_argument('mst_csv')
+    parser.add_argument('--tile-size', type=float, default=1000, help="Tile edge length in world units")
+    parser.add_argument('--output-dir', default='tiles')
+    args = parser.parse_args()
+
+    export_tiles(pd.read_csv(args.houses_csv), pd.read_csv(args.mst_csv), args.output_dir, args.tile_size)